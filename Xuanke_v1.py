@@ -7,20 +7,25 @@ NUAA 选课脚本
 - 预热 defaultPage，仿真 XHR 头。
 - 提交阶段优先使用与拉取课表时相同的参数名；若被重定向到统一认证，则自动换备选 URL。
 - 支持输入“序号”或“课程ID”两种方式选择课程。
-- 新增：对返回体进行“智能解码”（自动尝试 gzip/deflate/多编码），避免出现“乱码”日志。
+- 新增：对返回体进行“智能解码”（未声明 charset 时按 gb18030），避免出现“乱码”日志。
+- 放闸后所有课程并发提交，不再逐门排队等待网络往返。
 """
 
 import datetime
 import re
 import time
 import sys
+import socket
 import requests
-import zlib
-import gzip
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # ===== 学校固定地址 =====
-BASE = "https://aao-eas.nuaa.edu.cn"
+HOST = "aao-eas.nuaa.edu.cn"
+BASE = f"https://{HOST}"
 HOME_URL = f"{BASE}/eams/homeExt.action"
 DEFAULT_TPL = f"{BASE}/eams/stdElectCourse!defaultPage.action?electionProfile.id={{pid}}"
 
@@ -28,54 +33,53 @@ DEFAULT_TPL = f"{BASE}/eams/stdElectCourse!defaultPage.action?electionProfile.id
 REQUEST_TIMEOUT = 5          # 每次请求超时（秒）
 POST_INTERVAL = 0.7          # 提交间隔（秒），过快会触发“请不要过快点击”
 BACKOFF_SECONDS = 3          # 命中限速提示后的退避（秒）
+POOL_MAXSIZE = 32            # 每个主机保持的长连接上限，需不小于并发提交数
+BURST_WORKERS = 16           # 放闸后同时提交的线程数上限
+PREWARM_SECONDS = 2          # 放闸前多少秒预热连接
+PREWARM_TIMEOUT = (0.5, 0.5) # 预热请求的（连接, 读取）超时，只让卡住的预热尽早放手，不是总耗时上限
+WAIT_MAX_SLEEP = 30          # 等待放闸时单次最长睡眠（秒），醒来后按系统时间重新校准
 USER_AGENT = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 )
 
+# “统一身份认证”在两种常见编码下的字节串，检测时无需解码响应体
+_LOGIN_MARKERS = ("统一身份认证".encode("utf-8"), "统一身份认证".encode("gb18030"))
+
 def is_login_bounce(resp) -> bool:
-    """是否被重定向/返回到统一认证页面"""
-    try:
-        url_l = resp.url.lower()
-    except Exception:
-        url_l = ""
-    text = ""
+    """是否被重定向/返回到统一认证页面（只看 URL、Location 与响应体前 4KB 的字节）"""
+    if "authserver" in (resp.url or ""):
+        return True
+    # 提交时不跟随重定向，302 的目标在 Location 里
+    if resp.status_code in (301, 302, 303, 307, 308) and "authserver" in resp.headers.get("Location", ""):
+        return True
+    head = (resp.content or b"")[:4096]
+    return any(m in head for m in _LOGIN_MARKERS)
+
+def _resp_encoding(resp) -> str:
+    """响应体编码：服务器明确声明了（且 Python 认得）就用声明的，否则按 gb18030（兼容 gbk/gb2312）。
+    requests 会给没写 charset 的 text/* 补一个 ISO-8859-1，那不算声明；
+    也不去用 apparent_encoding，它要用 chardet 把整个响应体扫一遍"""
+    enc = resp.encoding
+    if not enc:
+        return "gb18030"
+    if enc.lower() == "iso-8859-1" and "charset" not in resp.headers.get("Content-Type", "").lower():
+        return "gb18030"
+    # 写错或不认识的 charset、以及 base64/hex 这类非文本编码，直接 decode 会抛 LookupError
     try:
-        text = resp.text
-    except Exception:
-        pass
-    return ("统一身份认证" in text) or ("authserver" in url_l)
-
-def smart_read(resp):
-    """尽最大可能把响应体解码成可读文本；返回 (text, used_encoding)"""
-    raw = resp.content or b""
-    # 先尝试按 headers 的 Content-Encoding 自动解压；requests 通常会处理，这里再兜底
-    def _maybe_decompress(b: bytes) -> bytes:
-        if len(b) >= 2 and b[0] == 0x1F and b[1] == 0x8B:  # gzip magic
-            try:
-                return gzip.decompress(b)
-            except Exception:
-                return b
-        if len(b) >= 2 and b[0] == 0x78 and b[1] in (0x01, 0x5E, 0x9C, 0xDA):  # zlib
-            try:
-                return zlib.decompress(b)
-            except Exception:
-                return b
-        return b
-
-    raw = _maybe_decompress(raw)
-
-    # 优先用服务器声明的编码与 requests 的检测
-    for enc in [getattr(resp, "encoding", None), getattr(resp, "apparent_encoding", None),
-                "utf-8", "gb18030", "gbk", "gb2312", "latin1"]:
-        if not enc:
-            continue
-        try:
-            return raw.decode(enc, errors="ignore"), enc
-        except Exception:
-            continue
-    # 兜底
-    return raw.decode("utf-8", errors="ignore"), "utf-8"
+        "".encode(enc)
+    except LookupError:
+        return "gb18030"
+    return enc
+
+def smart_read(resp, limit=None):
+    """把响应体解码成可读文本；返回 (text, used_encoding)
+    解压交给 requests/urllib3，编码见 _resp_encoding；
+    给了 limit 时只解码前 limit 个字节"""
+    resp.encoding = _resp_encoding(resp)
+    if limit is not None:
+        return resp.content[:limit].decode(resp.encoding, errors="ignore"), resp.encoding
+    return resp.text, resp.encoding
 
 def get_profile_id() -> str:
     pid = input("请输入选课网址末尾的数字（示例：4665）：").strip()
@@ -91,7 +95,22 @@ def get_cookie_manual() -> str:
     return input("粘贴 Cookie：").strip()
 
 def make_session(cookie_str: str, pid: str) -> requests.Session:
+    # 先解析一次域名：DNS 有问题时尽早报错，也让系统 DNS 缓存提前热起来
+    try:
+        socket.getaddrinfo(HOST, 443, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise RuntimeError(f"无法解析 {HOST}：{e}，请检查网络或 DNS 设置。")
+
     s = requests.Session()
+    # 不读 .netrc / 代理等环境设置，省掉每次请求的环境探测（因此也不会走系统代理）
+    s.trust_env = False
+    # Cookie 以请求头为准，jar 起始保持为空；重定向时 requests 会用 jar 里服务器下发的 Cookie 重建请求头
+    s.cookies.clear()
+    # 所有请求复用同一个连接池，放闸时不再为新连接付 TLS 握手；失败由脚本自己重试
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE,
+                          max_retries=Retry(total=0, backoff_factor=0))
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     # 直接把整行 Cookie 放进请求头，避免 CookieJar 域名/路径不匹配的坑
     s.headers.update({
         "User-Agent": USER_AGENT,
@@ -100,6 +119,7 @@ def make_session(cookie_str: str, pid: str) -> requests.Session:
         "Accept-Encoding": "gzip, deflate, br",
         "Origin": BASE,
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+        "Connection": "keep-alive",
     })
 
     # 0) 先打到首页
@@ -123,81 +143,72 @@ def make_session(cookie_str: str, pid: str) -> requests.Session:
 
 # ============ 拉取课程列表辅助 ============
 
-_ID_PATTERNS = [
-    re.compile(r"(?:\bprofileId\b|\belectionProfile\.id\b)\s*[:=]\s*['\"]?(\d+)"),
-    re.compile(r"(?:\?|&)(?:profileId|electionProfile\.id)=(\d+)"),
-]
-
-def _extract_profile_ids(html: str):
-    hits = []
-    for pat in _ID_PATTERNS:
-        hits += pat.findall(html)
-    # 去重保序
-    seen, out = set(), []
-    for h in hits:
-        if h not in seen:
-            seen.add(h)
-            out.append(h)
-    return out
+# 以下正则都是 bytes 版本，直接扫 resp.content，省掉整段响应体的解码
+# “profileId: 123” / “electionProfile.id=123” 与 URL 里的 “?profileId=123” 两种写法合成一个正则
+_ID_RE = re.compile(
+    rb"(?:\bprofileId\b|\belectionProfile\.id\b)\s*[:=]\s*['\"]?(\d+)"
+    rb"|[?&](?:profileId|electionProfile\.id)=(\d+)"
+)
+
+# 一门课的 id 与其后最近的 name（同一个 {...} 内）一次配对
+_COURSE_RE = re.compile(rb"id:(\d+),[^}]*?name:'([^']*)'")
+_HTML_RE = re.compile(rb"<html", re.IGNORECASE)
+
+def _extract_profile_ids(html: bytes):
+    # 一次扫描，dict.fromkeys 去重保序
+    return list(dict.fromkeys((m.group(1) or m.group(2)).decode("ascii") for m in _ID_RE.finditer(html)))
+
+def _is_course_data(status: int, raw: bytes) -> bool:
+    """data.action 正常返回的是带 id: 的 JS 数据，而不是 HTML 页面"""
+    return status == 200 and b"id:" in raw and not _HTML_RE.search(raw)
 
 def _try_fetch_data(session: requests.Session, pid: str):
-    """尝试两种参数名去拉 data.action；返回 (status, text, used_param)"""
+    """尝试两种参数名去拉 data.action；返回 (status, raw, encoding, used_param)，raw 为未解码的响应体"""
     url1 = f"{BASE}/eams/stdElectCourse!data.action?electionProfile.id={pid}"
     r1 = session.get(url1, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-    t1, _ = smart_read(r1)
-    if r1.status_code == 200 and "id:" in t1 and "<html" not in t1.lower():
-        return r1.status_code, t1, "electionProfile.id"
+    if _is_course_data(r1.status_code, r1.content):
+        return r1.status_code, r1.content, _resp_encoding(r1), "electionProfile.id"
 
     url2 = f"{BASE}/eams/stdElectCourse!data.action?profileId={pid}"
     r2 = session.get(url2, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-    t2, _ = smart_read(r2)
-    return r2.status_code, t2, "profileId"
+    return r2.status_code, r2.content, _resp_encoding(r2), "profileId"
 
 def course_info(session: requests.Session, pid: str):
     print("正在获取抢课信息，请稍候……")
 
     # 1) 直接用用户输入的 pid 尝试
-    status, text, used = _try_fetch_data(session, pid)
-    if status != 200 or "id:" not in text or "<html" in text.lower():
+    status, raw, enc, used = _try_fetch_data(session, pid)
+    if not _is_course_data(status, raw):
         # 2) 从 defaultPage 反向解析候选 pid
         warm = session.get(DEFAULT_TPL.format(pid=pid), timeout=REQUEST_TIMEOUT, allow_redirects=True)
-        candidates = _extract_profile_ids(warm.text)
+        candidates = _extract_profile_ids(warm.content)
         if not candidates:
             dp = session.get(f"{BASE}/eams/stdElectCourse!defaultPage.action",
                              timeout=REQUEST_TIMEOUT, allow_redirects=True)
-            candidates = _extract_profile_ids(dp.text)
+            candidates = _extract_profile_ids(dp.content)
         for cand in ([pid] + candidates):
-            status, text, used = _try_fetch_data(session, cand)
-            if status == 200 and "id:" in text and "<html" not in text.lower():
+            status, raw, enc, used = _try_fetch_data(session, cand)
+            if _is_course_data(status, raw):
                 pid = cand
                 break
 
-    if status != 200 or "id:" not in text or "<html" in text.lower():
+    if not _is_course_data(status, raw):
         print("课程列表请求返回异常状态码：", status)
-        print(text[:300])
+        print(raw[:300].decode(enc, errors="ignore"))
         sys.exit(1)
 
-    # 解析课程
-    find_id = re.compile(r"id:(\d+),")
-    find_name = re.compile(r"name:'([^']*)',")
-    id_list = find_id.findall(text)
-    name_list = []
-    for item in text.split("code:"):
-        m = find_name.findall(item)
-        if m:
-            name_list.append(m[0])
-        else:
-            break
-
-    if not id_list:
-        print("未解析到任何课程 ID，返回片段：", text[:300])
+    # 解析课程：只有命中的课程名才解码成文本
+    courses = [(m.group(1).decode("ascii"), m.group(2).decode(enc, errors="ignore"))
+               for m in _COURSE_RE.finditer(raw)]
+
+    if not courses:
+        print("未解析到任何课程 ID，返回片段：", raw[:300].decode(enc, errors="ignore"))
         sys.exit(1)
 
-    n = min(len(id_list), len(name_list))
     print("\n命中的选课档案ID:", pid, f"(参数名 {used})")
     print("可选课程：")
-    for i in range(n):
-        print(f"序号: {i:<3}  课程ID: {id_list[i]:<10}  课程名称: {name_list[i]}")
+    for i, (cid, name) in enumerate(courses):
+        print(f"序号: {i:<3}  课程ID: {cid:<10}  课程名称: {name}")
 
     # 支持“序号”或“课程ID”混填
     print("\n请输入想要抢的‘序号’或‘课程ID’（可多个，空格分隔）：")
@@ -205,14 +216,14 @@ def course_info(session: requests.Session, pid: str):
     # tokens = "400785 398319 398891 398568".split()
 
     chosen = []
-    id_set = set(id_list)
+    id_set = {cid for cid, _ in courses}
     for t in tokens:
         if not t.isdigit():
             print(f"非法输入：{t}")
             continue
         idx = int(t)
-        if 0 <= idx < n:
-            chosen.append(id_list[idx])
+        if 0 <= idx < len(courses):
+            chosen.append(courses[idx][0])
             continue
         if t in id_set:
             chosen.append(t)
@@ -226,6 +237,60 @@ def course_info(session: requests.Session, pid: str):
 
 # ============ 提交选课 ============
 
+# 选课表单结构固定（课程 ID 为纯数字，无需转义），直接按模板拼出 urlencoded 结果
+BODY_TPL = "optype=true&operator0={cid}%3Atrue%3A0&lesson0={cid}"
+
+# 日志只摘取返回体开头的中文提示，不扫描整个响应
+_CN_RE = re.compile(r"[\u4e00-\u9fa5]+")
+
+def _submit_one(session: requests.Session, post_urls, body: bytes):
+    """提交一门课：先用首选 URL，被踢回统一认证或异常时换备选 URL；都失败返回 None"""
+    for url in post_urls:
+        try:
+            resp = session.post(url, data=body, timeout=REQUEST_TIMEOUT, allow_redirects=False)
+        except Exception:
+            continue
+        # 被踢回统一认证，视为失败，换下一个 URL
+        if is_login_bounce(resp):
+            continue
+        return resp
+    return None
+
+def _now_ts() -> str:
+    """当前时间 HH:MM:SS.mmm，用于提交日志"""
+    t = time.time()
+    return time.strftime("%H:%M:%S", time.localtime(t)) + f".{int((t % 1) * 1000):03d}"
+
+def _mono_deadline(dt: datetime.datetime) -> float:
+    """把放闸的系统时间换算成当前的 monotonic 截止点。
+    每次醒来都要重新换算：系统对时、休眠都会让早先换算的结果失准"""
+    return time.monotonic() + (dt.timestamp() - time.time())
+
+def _prewarm(session: requests.Session, executor: ThreadPoolExecutor, n: int):
+    """放闸前预热，调用立即返回，不等任何网络请求：
+    - 另起一个一次性线程池，对 home.action 并发发 n 个 HEAD，在 session 共享的连接池里建好长连接；
+    - 给提交用的 executor 投 n 个只等彼此到齐的空任务，把提交线程提前起好。
+    预热请求再慢也只占着自己的线程和那条连接，放闸时提交线程是空闲的，最多为缺的连接重新握手"""
+    def _head():
+        try:
+            session.head(f"{BASE}/eams/home.action", timeout=PREWARM_TIMEOUT, allow_redirects=False)
+        except Exception:
+            pass
+    warm_pool = ThreadPoolExecutor(max_workers=n)
+    for _ in range(n):
+        warm_pool.submit(_head)
+    warm_pool.shutdown(wait=False)
+
+    # n 个空任务同时在跑才能越过 barrier，逼线程池把 n 个线程都起出来
+    barrier = threading.Barrier(n)
+    def _ready():
+        try:
+            barrier.wait(timeout=PREWARM_SECONDS / 2)
+        except threading.BrokenBarrierError:
+            pass
+    for _ in range(n):
+        executor.submit(_ready)
+
 def grab_courses(session: requests.Session, lesson_ids, pid: str, used_param: str):
     # open_at = input("请输入抢课开启时间（格式：YYYY-MM-DD HH:MM:SS）：").strip()
     open_at = "2025-9-16 16:00:00"
@@ -242,58 +307,74 @@ def grab_courses(session: requests.Session, lesson_ids, pid: str, used_param: st
     else:
         post_urls = [f"{base_post}?electionProfile.id={pid}", f"{base_post}?profileId={pid}"]
 
-    forms = [{"optype": "true", "operator0": f"{cid}:true:0", "lesson0": cid} for cid in lesson_ids]
-
-    # ——新增：两次提交的最小全局间隔，避免同一时间内多次提交——
-    POST_MIN_GAP = 0.8  # 可按需调到 1.6～1.8 更稳
-    last_post_ts = 0.0  # monotonic 时间戳
-
-    print("\n开始等待放闸时间……")
-    while True:
-        now = datetime.datetime.now()
-        if now >= dt:
-            for data in forms:
-                sent_ok = False
-                for url in post_urls:
-                    # ——限速关键处：每次真正提交前，确保与上次提交至少间隔 POST_MIN_GAP——
-                    gap = time.monotonic() - last_post_ts
-                    if gap < POST_MIN_GAP:
-                        # 加一点抖动，避免卡在整秒
-                        # time.sleep((POST_MIN_GAP - gap) + random.uniform(0.18, 0.35))
-                        time.sleep(POST_MIN_GAP - gap)
-
-                    try:
-                        resp = session.post(url, data=data, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-                        # 记录“这次提交已经发生”
-                        last_post_ts = time.monotonic()
-
-                        # 被踢回统一认证，视为失败，换下一个 URL
-                        if is_login_bounce(resp):
-                            continue
-
-                        body, enc = smart_read(resp)
-                        chinese = re.findall(r"([\u4e00-\u9fa5]+)", body)
-                        msg = "".join(chinese) or body[:180]
-                        # 用当前时间打印更准确
-                        ts = datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]
-                        print(f"[{ts}] {resp.status_code} -> {msg}")
-
-                        sent_ok = True
-                        if ("请不要过快点击" in body) or (resp.status_code in (429, 503)):
-                            time.sleep(BACKOFF_SECONDS)
-                        break
-                    except Exception:
-                        # 提交异常也算一次尝试，已限速；继续下一个 URL
-                        continue
-
-                if not sent_ok:
-                    print("提交未成功：两个提交地址都被重定向或异常")
-        else:
-            remain = dt - now
-            print(f"抢课界面未开启，剩余：{remain}")
-
-        # 维持你原有的外层节奏
-        time.sleep(POST_INTERVAL)
+    # 表单只编码一次，放闸后每次提交直接发 bytes
+    form_bodies = [BODY_TPL.format(cid=cid).encode("ascii") for cid in lesson_ids]
+
+    warmed = False
+
+    # 线程池在整个抢课过程中复用：放闸前用来预热，放闸后每轮把所有课程同时发出去
+    workers = min(BURST_WORKERS, len(form_bodies))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        print("\n开始等待放闸时间……")
+        while True:
+            deadline_mono = _mono_deadline(dt)
+            prewarm_at = deadline_mono - PREWARM_SECONDS
+            now_mono = time.monotonic()
+            if not warmed and now_mono >= prewarm_at:
+                # 已经放闸就不再预热，免得和第一轮提交抢服务器
+                if now_mono < deadline_mono:
+                    _prewarm(session, executor, workers)
+                warmed = True
+                continue
+            remaining = deadline_mono - now_mono
+            if remaining <= 0.1:
+                break
+            if not warmed:
+                print(f"抢课界面未开启，剩余：{datetime.timedelta(seconds=int(remaining))}")
+            # 先睡到预热时刻，预热后再睡到放闸前约 50ms；单次最多睡 WAIT_MAX_SLEEP，醒来重新校准
+            wake_at = deadline_mono - 0.05 if warmed else prewarm_at
+            time.sleep(min(wake_at - now_mono, WAIT_MAX_SLEEP))
+        # 自旋前最后按系统时间校准一次
+        deadline_mono = _mono_deadline(dt)
+        # 最后约 50ms 不再交给调度器：先让出 CPU 地轮询，最后 2ms 纯自旋，放闸误差压到亚毫秒
+        while time.monotonic() < deadline_mono - 0.002:
+            time.sleep(0)
+        while time.monotonic() < deadline_mono:
+            pass
+
+        # 放闸：每轮所有课程并发提交，谁先返回先打印谁
+        while True:
+            throttled = False
+            futs = {executor.submit(_submit_one, session, post_urls, fb): cid
+                    for cid, fb in zip(lesson_ids, form_bodies)}
+            for fut in as_completed(futs):
+                cid = futs[fut]
+                resp = fut.result()
+                if resp is None:
+                    print(f"课程 {cid} 提交未成功：两个提交地址都被重定向或异常")
+                    continue
+
+                # 限流状态码直接退避，不去解码返回体
+                if resp.status_code in (429, 503):
+                    print(f"[{_now_ts()}] {cid} {resp.status_code} -> 服务器限流")
+                    throttled = True
+                    continue
+
+                # 提示语都在返回体开头，只解码前 2KB
+                body, enc = smart_read(resp, limit=2048)
+                chinese = _CN_RE.findall(body[:512])
+                msg = "".join(chinese) or body[:180]
+                # 用当前时间打印更准确
+                print(f"[{_now_ts()}] {cid} {resp.status_code} -> {msg}")
+
+                if "请不要过快点击" in body:
+                    throttled = True
+            # 本轮有任何一门命中限速，整体退避一次
+            if throttled:
+                time.sleep(BACKOFF_SECONDS)
+
+            # 维持你原有的外层节奏
+            time.sleep(POST_INTERVAL)
 
 
 def main():